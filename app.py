@@ -3,19 +3,28 @@ Flask Web Interface for TV Series Organizer
 """
 
 import os
-import json
+import errno
 import logging
+import re
 import shutil
+import time
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from flask import Flask, render_template, request, jsonify, session, Response
+try:
+    import waitress
+except ImportError:  # optional: fall back to the Flask development server
+    waitress = None
 from organize_series import (
     get_directory_tree,
-    call_deepseek_api,
-    generate_preview_tree
+    stream_deepseek_api,
+    generate_preview_tree,
+    find_related_files
 )
 
 # Setup logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -26,28 +35,156 @@ WORKSPACE = Path(__file__).parent
 TV_UNORDERED = WORKSPACE / "tv_unordered"
 TV = WORKSPACE / "tv"
 
+# File names counted as episodes on the index page (any extension case)
+VIDEO_RE = re.compile(r'\.(?:mkv|mp4|avi)$', re.IGNORECASE)
+
+# Progress events are coalesced: one SSE frame per batch of files or interval
+PROGRESS_BATCH_SIZE = 8
+PROGRESS_INTERVAL = 0.1  # seconds
+
+# Number of files linked/copied concurrently during /apply
+PLACE_FILE_WORKERS = 8
+
+# Number of folders scanned concurrently when rendering the index page
+INDEX_SCAN_WORKERS = 8
+
+# Structure returned by /analyze, kept in the source folder until applied
+PENDING_STRUCTURE_FILE = '.pending_structure.json'
+
+# Parsed file_mappings.json per path, keyed by st_mtime_ns for invalidation
+_mapping_cache = {}
+
+
+def sse_message(payload: dict) -> str:
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+
+def copy_file_data(src, dst):
+    """Copy file contents, letting the kernel do the copy when it can
+
+    os.copy_file_range() copies without passing data through userspace and
+    lets filesystems such as btrfs/XFS share extents (reflink) or NFS copy
+    server-side. When it is unavailable or unsupported for this pair of
+    files, shutil.copyfile() is used, which uses sendfile() on Linux.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # Opening dst for writing would truncate src
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    
+    if hasattr(os, 'copy_file_range'):
+        copied = 0
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            if copied == size:
+                return
+        except OSError as e:
+            # Like shutil's own fast-copy: any failure before the first byte
+            # (EXDEV, ENOSYS, seccomp EPERM, ...) just means "not usable here"
+            if copied or e.errno == errno.ENOSPC:
+                raise
+            logger.debug(f"copy_file_range not usable, falling back to copyfile: {e}")
+    
+    shutil.copyfile(str(src), str(dst))
+
 
 def copy_with_metadata(src, dst):
     """Copy file preserving all metadata including owner and permissions"""
-    # First copy the file content and basic metadata
-    shutil.copy2(str(src), str(dst))
+    # First copy the file content and basic metadata (what shutil.copy2 does)
+    copy_file_data(src, dst)
+    shutil.copystat(str(src), str(dst))
     
     # Try to preserve ownership (Unix/Linux only)
     try:
         src_stat = os.stat(str(src))
         os.chown(str(dst), src_stat.st_uid, src_stat.st_gid)
-        logger.info(f"Preserved ownership: UID={src_stat.st_uid}, GID={src_stat.st_gid}")
+        logger.debug(f"Preserved ownership: UID={src_stat.st_uid}, GID={src_stat.st_gid}")
     except (AttributeError, OSError, PermissionError) as e:
         # os.chown not available on Windows or no permissions
         logger.debug(f"Could not preserve ownership (this is normal on Windows): {e}")
     
-    # Ensure permissions are copied (redundant with copy2 but explicit)
+    # Ensure permissions are copied again, chown may have cleared setuid bits
     try:
         shutil.copystat(str(src), str(dst))
     except Exception as e:
         logger.warning(f"Could not copy all stat info: {e}")
 
 
+def place_file(src, dst, method):
+    """Create a symlink (or copy when method is 'copy') of src at dst"""
+    if method == 'symlink':
+        try:
+            os.symlink(os.path.realpath(src), dst)
+            logger.debug(f"Symbolic link created: {src} -> {dst}")
+            return
+        except OSError as e:
+            logger.error(f"Failed to create symbolic link, falling back to copy: {e}")
+    
+    copy_with_metadata(src, dst)
+    logger.debug(f"File copied: {src} -> {dst}")
+
+
+def load_mapping_data(path, mtime_ns):
+    """Return parsed mapping file contents, re-reading only when mtime changes"""
+    cached = _mapping_cache.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    
+    mapping_data = orjson.loads(Path(path).read_bytes())
+    _mapping_cache[path] = (mtime_ns, mapping_data)
+    return mapping_data
+
+
+def clear_pending_structure():
+    """Forget the pending organization and remove its stored structure"""
+    folder_name = session.pop('pending_folder', None)
+    if folder_name:
+        (TV_UNORDERED / folder_name / PENDING_STRUCTURE_FILE).unlink(missing_ok=True)
+
+
+def describe_folder(folder):
+    """Summarize a tv_unordered folder entry for the index page"""
+    # Count video files and spot the mapping file in a single directory pass
+    video_count = 0
+    mapping_entry = None
+    try:
+        with os.scandir(folder.path) as it:
+            for f in it:
+                if f.name == 'file_mappings.json':
+                    mapping_entry = f
+                elif VIDEO_RE.search(f.name) and f.is_file():
+                    video_count += 1
+    except OSError as e:
+        # An unreadable folder is still listed, just without files
+        logger.error(f"Error scanning folder {folder.path}: {e}")
+        return {'name': folder.name, 'file_count': 0, 'applied': None}
+    
+    # Check if already applied
+    applied_info = None
+    if mapping_entry is not None:
+        try:
+            mapping_data = load_mapping_data(mapping_entry.path, mapping_entry.stat().st_mtime_ns)
+            applied_info = {
+                'applied_at': mapping_data.get('applied_at'),
+                'destination': mapping_data.get('destination_folder'),
+                'file_count': len(mapping_data.get('file_mappings', []))
+            }
+        except Exception as e:
+            logger.error(f"Error reading mapping file {mapping_entry.path}: {e}")
+    
+    return {
+        'name': folder.name,
+        'file_count': video_count,
+        'applied': applied_info
+    }
+
+
 @app.route('/')
 def index():
     """Main page - list all folders in tv_unordered"""
@@ -60,30 +197,13 @@ def index():
     
     # Get all folders with file counts
     folders = []
-    for folder in TV_UNORDERED.iterdir():
-        if folder.is_dir():
-            # Count video files (.mkv, .mp4, .avi)
-            video_files = list(folder.glob('*.mkv')) + list(folder.glob('*.mp4')) + list(folder.glob('*.avi'))
-            
-            # Check if already applied
-            mapping_file = folder / 'file_mappings.json'
-            applied_info = None
-            if mapping_file.exists():
-                try:
-                    mapping_data = json.loads(mapping_file.read_text())
-                    applied_info = {
-                        'applied_at': mapping_data.get('applied_at'),
-                        'destination': mapping_data.get('destination_folder'),
-                        'file_count': len(mapping_data.get('file_mappings', []))
-                    }
-                except Exception as e:
-                    logger.error(f"Error reading mapping file {mapping_file}: {e}")
-            
-            folders.append({
-                'name': folder.name,
-                'file_count': len(video_files),
-                'applied': applied_info
-            })
+    with os.scandir(TV_UNORDERED) as it:
+        folder_entries = [entry for entry in it if entry.is_dir()]
+    
+    # Folders are independent, so scan them concurrently
+    if folder_entries:
+        with ThreadPoolExecutor(max_workers=min(INDEX_SCAN_WORKERS, len(folder_entries))) as executor:
+            folders = list(executor.map(describe_folder, folder_entries))
     
     # Check API key
     api_key = os.getenv("DEEPSEEK_API_KEY", "")
@@ -113,43 +233,71 @@ def analyze():
     if not folder_path.exists():
         return jsonify({'error': 'Folder not found'}), 404
     
+    pending_file = folder_path / PENDING_STRUCTURE_FILE
+    
     try:
+        # Drop the structure of whatever was pending before (possibly another
+        # folder) and any leftover from an earlier analysis of this folder
+        clear_pending_structure()
+        pending_file.unlink(missing_ok=True)
+        
         # Get tree
         tree = get_directory_tree(str(folder_path))
-        
-        # Call LLM
-        structure = call_deepseek_api(api_key, tree, folder_name)
-        
-        # Generate preview
-        preview = generate_preview_tree(structure, str(TV))
-        
-        # Store structure in session for later use
-        session['structure'] = structure
-        session['source_folder'] = str(folder_path)
-        
-        return jsonify({
-            'success': True,
-            'series_name': structure['series_name'],
-            'year': structure['year'],
-            'episodes_count': len(structure['episodes']),
-            'original_tree': tree,
-            'preview_tree': preview,
-            'structure': structure
-        })
-        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    # The session cookie is sent before the streamed body, so mark the
+    # folder as pending up front; /apply reports no pending organization
+    # until the structure file has been written
+    session['pending_folder'] = folder_name
+    
+    def generate():
+        """Generator streaming the LLM response followed by the preview"""
+        try:
+            # Call LLM, forwarding text as it arrives
+            chunks = []
+            for text in stream_deepseek_api(api_key, tree, folder_name):
+                chunks.append(text)
+                yield sse_message({'type': 'delta', 'text': text})
+            structure = orjson.loads("".join(chunks))
+            
+            # Generate preview
+            preview = generate_preview_tree(structure, str(TV))
+            
+            # Store structure next to the source files; the session only
+            # remembers which folder is pending
+            pending_file.write_bytes(orjson.dumps(structure))
+            
+            yield sse_message({
+                'type': 'done',
+                'series_name': structure['series_name'],
+                'year': structure['year'],
+                'episodes_count': len(structure['episodes']),
+                'original_tree': tree,
+                'preview_tree': preview,
+                'structure': structure
+            })
+            
+        except Exception as e:
+            logger.error(f"Error during analysis: {e}", exc_info=True)
+            yield sse_message({'type': 'error', 'error': str(e)})
+    
+    return Response(generate(), mimetype='text/event-stream')
 
 
 @app.route('/apply', methods=['GET'])
 def apply_organization():
     """Apply the organization with progress tracking"""
     
-    # Get structure from session
-    structure = session.get('structure')
-    source_folder = session.get('source_folder')
+    # Get structure stored by /analyze for the pending folder
+    pending_folder = session.get('pending_folder')
+    if not pending_folder:
+        return jsonify({'error': 'No pending organization'}), 400
     
-    if not structure or not source_folder:
+    source_folder = str(TV_UNORDERED / pending_folder)
+    try:
+        structure = orjson.loads((TV_UNORDERED / pending_folder / PENDING_STRUCTURE_FILE).read_bytes())
+    except (OSError, orjson.JSONDecodeError):
         return jsonify({'error': 'No pending organization'}), 400
     
     # Get method from query parameter (default to symlink)
@@ -161,135 +309,118 @@ def apply_organization():
             logger.info("=== Starting apply_organization ===")
             logger.info(f"Source folder: {source_folder}")
             logger.info(f"Organization method: {method}")
-            logger.info(f"Structure: {json.dumps(structure, indent=2)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Structure: {orjson.dumps(structure, option=orjson.OPT_INDENT_2).decode()}")
             
             series_name = structure['series_name']
             year = structure['year']
             folder_name = f"{series_name} ({year})" if year else series_name
             
-            series_path = Path(str(TV)) / folder_name
+            series_path = TV / folder_name
+            series_dir = str(series_path)
+            cwd = os.getcwd()  # mapping paths are stored relative to this
             logger.info(f"Series path: {series_path}")
             
-            total_files = 0
             moved_files = 0
             
-            # Count total files (episodes + related files)
-            import glob as glob_module
-            logger.info(f"Counting files from {len(structure['episodes'])} episodes...")
+            # Resolve related files for every episode in a single pass;
+            # the same lookup drives both the total count and the linking
+            scanned = {}  # parent directory -> group_files_by_stem() result
+            episodes_to_process = []
+            logger.info(f"Collecting files from {len(structure['episodes'])} episodes...")
             for ep in structure['episodes']:
-                source_file = Path(source_folder) / ep['original_filename']
-                logger.info(f"Checking: {source_file}")
-                logger.info(f"Exists: {source_file.exists()}")
-                if source_file.exists():
-                    # Count related files
-                    source_stem = source_file.stem
-                    source_parent = source_file.parent
-                    escaped_stem = glob_module.escape(source_stem)
-                    related = list(source_parent.glob(f"{escaped_stem}.*"))
-                    logger.info(f"Related files for {source_stem}: {[f.name for f in related]}")
-                    total_files += len(related)
-            
-            logger.info(f"Total files to move: {total_files}")
-            # Send total count
-            yield f"data: {json.dumps({'type': 'total', 'total': total_files})}\n\n"
+                source_file = os.path.join(source_folder, ep['original_filename'])
+                source_name = os.path.basename(source_file)
+                related = find_related_files(source_file, scanned)
+                if not any(entry.name == source_name for entry in related):
+                    logger.warning(f"Source file not found, skipping: {source_file}")
+                    continue
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Related files for {source_name}: {[f.name for f in related]}")
+                episodes_to_process.append((ep, source_name, related))
             
-            # Track file mappings for all files
+            # Plan every link/copy up front; mappings keep the episode order
             all_file_mappings = []
+            tasks = []
+            planned_targets = set()
+            season_folders = {}  # season number -> created season folder path
             
-            # Process files
-            logger.info(f"Starting to process {len(structure['episodes'])} episodes")
-            for ep in structure['episodes']:
+            logger.info(f"Starting to process {len(episodes_to_process)} episodes")
+            for ep, source_name, related in episodes_to_process:
                 season_num = ep['season']
-                season_folder = series_path / f"Season {season_num:02d}"
+                season_folder = season_folders.get(season_num)
+                if season_folder is None:
+                    # Create each season folder once, not once per episode
+                    season_folder = os.path.join(series_dir, f"Season {season_num:02d}")
+                    logger.debug(f"Creating season folder: {season_folder}")
+                    os.makedirs(season_folder, exist_ok=True)
+                    season_folders[season_num] = season_folder
+                logger.debug(f"Processing episode: {ep['original_filename']}")
                 
-                # Find source file
-                source_file = Path(source_folder) / ep['original_filename']
-                logger.info(f"Processing episode: {ep['original_filename']}")
-                logger.info(f"Source file path: {source_file}")
-                logger.info(f"Source file exists: {source_file.exists()}")
+                dest_stem = os.path.splitext(ep['new_filename'])[0]
+                logger.debug(f"Found {len(related)} files to move for {source_name}")
                 
-                if not source_file.exists():
-                    logger.warning(f"Source file not found, skipping: {source_file}")
-                    continue
-                
-                dest_file = season_folder / ep['new_filename']
-                logger.info(f"Destination: {dest_file}")
-                logger.info(f"Creating season folder: {season_folder}")
-                season_folder.mkdir(parents=True, exist_ok=True)
-                
-                # Collect all related files BEFORE moving anything
-                source_stem = source_file.stem
-                source_parent = source_file.parent
-                dest_stem = dest_file.stem
-                
-                # Escape special glob characters in filename
-                import glob as glob_module
-                escaped_stem = glob_module.escape(source_stem)
-                
-                related_files = list(source_parent.glob(f"{escaped_stem}.*"))
-                logger.info(f"Found {len(related_files)} files to move for {source_stem}")
-                
-                # Create hard links for all files (main + related)
-                for file_to_move in related_files:
-                    logger.info(f"Creating link for file: {file_to_move}")
-                    if file_to_move == source_file:
-                        # Create hard link for main video file
-                        logger.info(f"Creating hard link: {file_to_move} -> {dest_file}")
-                        
-                        # Record mapping
-                        all_file_mappings.append({
-                            'old_path': str(file_to_move.relative_to(Path.cwd())),
-                            'new_path': str(dest_file.relative_to(Path.cwd())),
-                            'old_name': file_to_move.name,
-                            'new_name': dest_file.name
-                        })
-                        
-                        # Create link or copy based on selected method
-                        if method == 'symlink':
-                            try:
-                                os.symlink(str(file_to_move.resolve()), str(dest_file))
-                                moved_files += 1
-                                logger.info("Symbolic link created successfully")
-                            except OSError as e:
-                                logger.error(f"Failed to create symbolic link, falling back to copy: {e}")
-                                copy_with_metadata(file_to_move, dest_file)
-                                moved_files += 1
-                        else:  # method == 'copy'
-                            copy_with_metadata(file_to_move, dest_file)
-                            moved_files += 1
-                            logger.info("File copied successfully")
-                        
-                        yield f"data: {json.dumps({'type': 'progress', 'current': moved_files, 'total': total_files, 'filename': ep['new_filename']})}\n\n"
+                for entry in related:
+                    if entry.name == source_name:
+                        target_name = ep['new_filename']
                     else:
-                        # Create link/copy for related file (keep same extension)
-                        extension = file_to_move.suffix
-                        related_dest = season_folder / f"{dest_stem}{extension}"
-                        logger.info(f"Processing related file: {file_to_move} -> {related_dest}")
-                        
-                        # Record mapping
-                        all_file_mappings.append({
-                            'old_path': str(file_to_move.relative_to(Path.cwd())),
-                            'new_path': str(related_dest.relative_to(Path.cwd())),
-                            'old_name': file_to_move.name,
-                            'new_name': related_dest.name
-                        })
-                        
-                        # Create link or copy based on selected method
-                        if method == 'symlink':
-                            try:
-                                os.symlink(str(file_to_move.resolve()), str(related_dest))
-                                moved_files += 1
-                                logger.info("Symbolic link created successfully")
-                            except OSError as e:
-                                logger.error(f"Failed to create symbolic link, falling back to copy: {e}")
-                                copy_with_metadata(file_to_move, related_dest)
-                                moved_files += 1
-                        else:  # method == 'copy'
-                            copy_with_metadata(file_to_move, related_dest)
-                            moved_files += 1
-                            logger.info("File copied successfully")
+                        # Related file (subtitles, .nfo, ...) keeps its extension
+                        target_name = f"{dest_stem}{os.path.splitext(entry.name)[1]}"
+                    target = os.path.join(season_folder, target_name)
+                    
+                    # Files run in parallel, so two sources must never share a
+                    # target (e.g. Ep.en.srt and Ep.ru.srt, or a repeated episode)
+                    if target in planned_targets:
+                        logger.warning(f"Target already planned, skipping: {entry.path} -> {target}")
+                        continue
+                    planned_targets.add(target)
+                    logger.debug(f"Planned: {entry.path} -> {target}")
+                    
+                    # Record mapping
+                    all_file_mappings.append({
+                        'old_path': os.path.relpath(entry.path, cwd),
+                        'new_path': os.path.relpath(target, cwd),
+                        'old_name': entry.name,
+                        'new_name': target_name
+                    })
+                    tasks.append((entry.path, target))
+            
+            total_files = len(tasks)
+            
+            logger.info(f"Total files to move: {total_files}")
+            # Send total count
+            yield sse_message({'type': 'total', 'total': total_files})
+            
+            # Progress not yet reported to the client
+            pending_events = 0
+            last_filename = None
+            last_event_at = time.monotonic()
+            
+            # Create links/copies concurrently, reporting as each one finishes
+            with ThreadPoolExecutor(max_workers=PLACE_FILE_WORKERS) as executor:
+                futures = {
+                    executor.submit(place_file, src, dst, method): dst
+                    for src, dst in tasks
+                }
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                        moved_files += 1
+                        last_filename = os.path.basename(futures[future])
                         
-                        yield f"data: {json.dumps({'type': 'progress', 'current': moved_files, 'total': total_files, 'filename': related_dest.name})}\n\n"
+                        pending_events += 1
+                        if pending_events >= PROGRESS_BATCH_SIZE or time.monotonic() - last_event_at >= PROGRESS_INTERVAL:
+                            yield sse_message({'type': 'progress', 'current': moved_files, 'total': total_files, 'filename': last_filename})
+                            pending_events = 0
+                            last_event_at = time.monotonic()
+                except BaseException:
+                    # Don't start queued work after a failure or client disconnect
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+            
+            # Flush progress left over from the last batch
+            if pending_events:
+                yield sse_message({'type': 'progress', 'current': moved_files, 'total': total_files, 'filename': last_filename})
             
             # Create .applied marker and mapping file in source folder
             source_folder_path = Path(source_folder)
@@ -305,20 +436,20 @@ def apply_organization():
                 'applied_at': datetime.now().isoformat(),
                 'series_name': structure['series_name'],
                 'year': structure['year'],
-                'destination_folder': str(series_path.relative_to(Path.cwd())),
+                'destination_folder': os.path.relpath(series_dir, cwd),
                 'file_mappings': all_file_mappings
             }
-            mapping_file.write_text(json.dumps(mapping_data, indent=2))
+            mapping_file.write_bytes(orjson.dumps(mapping_data))
             logger.info(f"Created {applied_marker} and {mapping_file}")
             logger.info(f"Saved {len(all_file_mappings)} file mappings")
             
             # Send completion
             logger.info(f"=== Completed: moved {moved_files} files ===")
-            yield f"data: {json.dumps({'type': 'complete', 'message': 'Organization applied successfully', 'total': moved_files})}\n\n"
+            yield sse_message({'type': 'complete', 'message': 'Organization applied successfully', 'total': moved_files})
             
         except Exception as e:
             logger.error(f"Error during organization: {e}", exc_info=True)
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            yield sse_message({'type': 'error', 'error': str(e)})
     
     return Response(generate(), mimetype='text/event-stream')
 
@@ -326,8 +457,7 @@ def apply_organization():
 @app.route('/apply/complete', methods=['POST'])
 def apply_complete():
     """Clear session after organization complete"""
-    session.pop('structure', None)
-    session.pop('source_folder', None)
+    clear_pending_structure()
     return jsonify({'success': True})
 
 
@@ -335,8 +465,7 @@ def apply_complete():
 def cancel():
     """Cancel pending organization"""
     
-    session.pop('structure', None)
-    session.pop('source_folder', None)
+    clear_pending_structure()
     
     return jsonify({'success': True})
 
@@ -358,7 +487,7 @@ def revert():
             return jsonify({'error': 'No mapping file found'}), 404
         
         # Read mapping
-        mapping_data = json.loads(mapping_file.read_text())
+        mapping_data = orjson.loads(mapping_file.read_bytes())
         file_mappings = mapping_data.get('file_mappings', [])
         
         logger.info(f"Reverting {len(file_mappings)} links for folder: {folder_name}")
@@ -375,7 +504,7 @@ def revert():
                     # Simply delete the link - original file remains
                     new_path.unlink()
                     files_reverted += 1
-                    logger.info(f"Removed link: {new_path}")
+                    logger.debug(f"Removed link: {new_path}")
                 else:
                     logger.warning(f"Link not found for revert: {new_path}")
                     
@@ -390,6 +519,7 @@ def revert():
             applied_marker.unlink()
         
         mapping_file.unlink()
+        _mapping_cache.pop(str(mapping_file), None)
         
         logger.info(f"Revert completed: {files_reverted} files reverted, {len(errors)} errors")
         
@@ -405,4 +535,11 @@ def revert():
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=9002, debug=True)
+    if os.getenv('FLASK_ENV') == 'development':
+        app.run(host='0.0.0.0', port=9002, debug=True)
+    elif waitress is not None:
+        # Multi-threaded, so a running /apply stream doesn't block other pages
+        waitress.serve(app, host='0.0.0.0', port=9002, threads=8)
+    else:
+        logger.warning("waitress is not installed, using the Flask development server")
+        app.run(host='0.0.0.0', port=9002, threaded=True)
@@ -8,22 +8,69 @@ import os
 import json
 import shutil
 from pathlib import Path
-from typing import List, Optional
-from dataclasses import dataclass
+from typing import Iterator, List, Optional, TypedDict
+from functools import lru_cache
 from openai import OpenAI
 
 
-@dataclass
-class Episode:
+# Prompts are built once; only the user prompt varies per folder
+SYSTEM_PROMPT = """You are a TV series file organizer. Analyze the directory structure and return ONLY a valid JSON object with this exact structure:
+{
+    "series_name": "Clean series name without tags",
+    "year": 2023 or null,
+    "episodes": [
+        {
+            "original_filename": "exact filename from tree",
+            "new_filename": "Series Name S01E01.mkv",
+            "season": 1,
+            "episode": 1
+        }
+    ]
+}
+
+Rules:
+- Only include video files (.mkv, .mp4, .avi)
+- year can be integer or null
+- season and episode must be integers
+- Return ONLY the JSON, no other text"""
+
+# Reused for every request so the prompt prefix stays identical between calls
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+USER_PROMPT_TEMPLATE = """Analyze this TV series folder structure and organize it properly.
+
+Folder name: {folder_name}
+Directory tree:
+{directory_tree}
+
+Extract:
+1. Series name (clean, without tags like [AniLibria.TV])
+2. Release year (if identifiable, otherwise null)
+3. For each video file (.mkv, .mp4, .avi):
+   - Season number (if not clear, assume Season 01)
+   - Episode number(s)
+   - New standardized filename in format: "Series Name S##E##.ext"
+   - Original file path
+
+Rules:
+- Use Season 00 for specials/OVA
+- For multi-episode files use S##E##-E## format
+- Keep extra info (like "Part 1") at the end
+- Include all video files only (.mkv, .mp4, .avi)
+- Use absolute numbering if seasons unclear
+
+Return structured JSON."""
+
+
+class Episode(TypedDict):
     """Episode file information"""
-    original_path: str
+    original_filename: str
     new_filename: str
     season: int
     episode: int
 
 
-@dataclass
-class SeriesStructure:
+class SeriesStructure(TypedDict):
     """Organized series structure"""
     series_name: str
     year: Optional[int]
@@ -32,102 +79,108 @@ class SeriesStructure:
 
 def get_directory_tree(path: str, prefix: str = "", max_depth: int = 3, current_depth: int = 0) -> str:
     """Generate tree structure of a directory"""
-    if current_depth >= max_depth:
+    if current_depth >= max_depth or not os.path.exists(path):
         return ""
     
-    tree = []
-    path_obj = Path(path)
+    def sorted_entries(dir_path):
+        with os.scandir(dir_path) as it:
+            return sorted(it, key=lambda e: (not e.is_dir(follow_symlinks=False), e.name))
     
-    if not path_obj.exists():
-        return ""
+    def push_children(dir_path, child_prefix, depth):
+        entries = sorted_entries(dir_path)
+        last = len(entries) - 1
+        # Reversed so the first entry is popped (and printed) first
+        for i in range(last, -1, -1):
+            stack.append((entries[i], child_prefix, i == last, depth))
     
-    items = sorted(path_obj.iterdir(), key=lambda x: (not x.is_dir(), x.name))
+    tree = []
+    stack = []
+    push_children(path, prefix, current_depth)
     
-    for i, item in enumerate(items):
-        is_last = i == len(items) - 1
-        current_prefix = "└── " if is_last else "├── "
-        tree.append(f"{prefix}{current_prefix}{item.name}")
+    # Depth-first walk; each directory's children are printed right after it
+    while stack:
+        entry, entry_prefix, is_last, depth = stack.pop()
+        tree.append(f"{entry_prefix}{'└── ' if is_last else '├── '}{entry.name}")
         
-        if item.is_dir() and current_depth < max_depth - 1:
+        if depth < max_depth - 1 and entry.is_dir(follow_symlinks=False):
             extension_prefix = "    " if is_last else "│   "
-            subtree = get_directory_tree(
-                str(item), 
-                prefix + extension_prefix, 
-                max_depth, 
-                current_depth + 1
-            )
-            if subtree:
-                tree.append(subtree)
+            push_children(entry.path, entry_prefix + extension_prefix, depth + 1)
     
     return "\n".join(tree)
 
 
-def call_deepseek_api(api_key: str, directory_tree: str, folder_name: str) -> dict:
-    """Call DeepSeek API to analyze series structure"""
-    
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.deepseek.com"
-    )
-    
-    prompt = f"""Analyze this TV series folder structure and organize it properly.
+def group_files_by_stem(path: str) -> dict:
+    """Scan a directory once and group its files by every dotted name prefix.
 
-Folder name: {folder_name}
-Directory tree:
-{directory_tree}
+    Looking up a stem returns the same files as ``glob(f"{stem}.*")``, so
+    ``Episode.en.srt`` is found under both ``Episode`` and ``Episode.en``.
+    """
+    by_stem = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                continue
+            name = entry.name
+            dot = name.find('.')
+            while dot != -1:
+                by_stem.setdefault(name[:dot], []).append(entry)
+                dot = name.find('.', dot + 1)
+    return by_stem
 
-Extract:
-1. Series name (clean, without tags like [AniLibria.TV])
-2. Release year (if identifiable, otherwise null)
-3. For each video file (.mkv, .mp4, .avi):
-   - Season number (if not clear, assume Season 01)
-   - Episode number(s)
-   - New standardized filename in format: "Series Name S##E##.ext"
-   - Original file path
 
-Rules:
-- Use Season 00 for specials/OVA
-- For multi-episode files use S##E##-E## format
-- Keep extra info (like "Part 1") at the end
-- Include all video files only (.mkv, .mp4, .avi)
-- Use absolute numbering if seasons unclear
+def find_related_files(source_file: str, scanned: dict) -> list:
+    """Return directory entries sharing source_file's stem (the file itself included)
 
-Return structured JSON."""
+    ``scanned`` caches ``group_files_by_stem()`` per directory so that each
+    directory is read once no matter how many episodes it holds.
+    """
+    parent, name = os.path.split(source_file)
+    if parent not in scanned:
+        try:
+            scanned[parent] = group_files_by_stem(parent)
+        except OSError:
+            scanned[parent] = {}
+    return scanned[parent].get(os.path.splitext(name)[0], [])
 
-    system_prompt = """You are a TV series file organizer. Analyze the directory structure and return ONLY a valid JSON object with this exact structure:
-{
-    "series_name": "Clean series name without tags",
-    "year": 2023 or null,
-    "episodes": [
-        {
-            "original_filename": "exact filename from tree",
-            "new_filename": "Series Name S01E01.mkv",
-            "season": 1,
-            "episode": 1
-        }
-    ]
-}
 
-Rules:
-- Only include video files (.mkv, .mp4, .avi)
-- year can be integer or null
-- season and episode must be integers
-- Return ONLY the JSON, no other text"""
+@lru_cache(maxsize=8)
+def get_deepseek_client(api_key: str) -> OpenAI:
+    """Return a DeepSeek client for api_key, reused so its connections stay open"""
+    return OpenAI(
+        api_key=api_key,
+        base_url="https://api.deepseek.com"
+    )
 
-    response = client.chat.completions.create(
+
+def stream_deepseek_api(api_key: str, directory_tree: str, folder_name: str) -> Iterator[str]:
+    """Call DeepSeek API and yield the JSON response text as it arrives"""
+    
+    client = get_deepseek_client(api_key)
+    prompt = USER_PROMPT_TEMPLATE.format(folder_name=folder_name, directory_tree=directory_tree)
+    
+    # Closing this generator early (e.g. the browser went away) closes the
+    # stream and returns its connection to the shared client's pool
+    with client.chat.completions.create(
         model="deepseek-chat",
         messages=[
-            {"role": "system", "content": system_prompt},
+            SYSTEM_MESSAGE,
             {"role": "user", "content": prompt}
         ],
         response_format={"type": "json_object"},
-        temperature=0.3
-    )
-    
-    return json.loads(response.choices[0].message.content)
+        temperature=0.3,
+        stream=True
+    ) as stream:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
 
-def generate_preview_tree(structure: dict, base_path: str) -> str:
+def call_deepseek_api(api_key: str, directory_tree: str, folder_name: str) -> SeriesStructure:
+    """Call DeepSeek API to analyze series structure"""
+    return json.loads("".join(stream_deepseek_api(api_key, directory_tree, folder_name)))
+
+
+def generate_preview_tree(structure: SeriesStructure, base_path: str) -> str:
     """Generate preview tree of the organized structure"""
     series_name = structure['series_name']
     year = structure['year']
@@ -136,83 +189,89 @@ def generate_preview_tree(structure: dict, base_path: str) -> str:
     # Group episodes by season
     seasons = {}
     for ep in structure['episodes']:
-        season_num = ep['season']
-        if season_num not in seasons:
-            seasons[season_num] = []
-        seasons[season_num].append(ep['new_filename'])
+        seasons.setdefault(ep['season'], []).append(ep['new_filename'])
+    
+    # Line prefixes: (season, episode, last episode of the season)
+    middle_season_prefixes = ("├── ", "│   ├── ", "│   └── ")
+    last_season_prefixes = ("└── ", "    ├── ", "    └── ")
     
     # Build tree
     tree_lines = [folder_name]
-    sorted_seasons = sorted(seasons.keys())
+    last_index = len(seasons) - 1
     
-    for i, season_num in enumerate(sorted_seasons):
-        is_last_season = i == len(sorted_seasons) - 1
-        season_prefix = "└── " if is_last_season else "├── "
-        season_name = f"Season {season_num:02d}"
-        tree_lines.append(f"{season_prefix}{season_name}")
-        
-        episodes = sorted(seasons[season_num])
-        for j, episode in enumerate(episodes):
-            is_last_ep = j == len(episodes) - 1
-            ep_prefix = "    └── " if is_last_season else "│   └── " if is_last_ep else "│   ├── " if not is_last_season else "    ├── "
-            if is_last_season:
-                ep_prefix = "    └── " if is_last_ep else "    ├── "
-            tree_lines.append(f"{ep_prefix}{episode}")
+    for i, (season_num, episodes) in enumerate(sorted(seasons.items())):
+        season_prefix, ep_prefix, last_ep_prefix = (
+            last_season_prefixes if i == last_index else middle_season_prefixes
+        )
+        episodes.sort()
+        tree_lines.append(f"{season_prefix}Season {season_num:02d}")
+        tree_lines.extend(f"{ep_prefix}{episode}" for episode in episodes[:-1])
+        tree_lines.append(f"{last_ep_prefix}{episodes[-1]}")
     
     return "\n".join(tree_lines)
 
 
-def organize_files(structure: dict, source_base: str, dest_base: str, dry_run: bool = True) -> bool:
+def organize_files(structure: SeriesStructure, source_base: str, dest_base: str, dry_run: bool = True) -> bool:
     """Organize files according to structure"""
     series_name = structure['series_name']
     year = structure['year']
     folder_name = f"{series_name} ({year})" if year else series_name
     
-    series_path = Path(dest_base) / folder_name
+    series_dir = os.path.join(dest_base, folder_name)
     
     print(f"\n{'[DRY RUN] ' if dry_run else ''}Organizing files...")
     
     moved_count = 0
+    scanned = {}  # parent directory -> group_files_by_stem() result
+    season_folders = {}  # season number -> season folder path (created unless dry run)
     for ep in structure['episodes']:
-        season_num = ep['season']
-        season_folder = series_path / f"Season {season_num:02d}"
-        
         # Find source file
-        source_file = Path(source_base) / ep['original_filename']
-        if not source_file.exists():
+        source_file = os.path.join(source_base, ep['original_filename'])
+        source_name = os.path.basename(source_file)
+        # The scan is cached but files are really moved, so skip entries an
+        # earlier episode already took (duplicate or overlapping names)
+        related_files = [
+            entry for entry in find_related_files(source_file, scanned)
+            if os.path.exists(entry.path)
+        ]
+        
+        if not any(entry.name == source_name for entry in related_files):
             print(f"⚠️  Warning: Source file not found: {source_file}")
             continue
         
-        dest_file = season_folder / ep['new_filename']
+        season_num = ep['season']
+        season_folder = season_folders.get(season_num)
+        if season_folder is None:
+            # Create each season folder once, not once per episode
+            season_folder = os.path.join(series_dir, f"Season {season_num:02d}")
+            if not dry_run:
+                os.makedirs(season_folder, exist_ok=True)
+            season_folders[season_num] = season_folder
         
         if not dry_run:
-            season_folder.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(source_file), str(dest_file))
+            shutil.move(source_file, os.path.join(season_folder, ep['new_filename']))
             print(f"✓ Moved: {ep['original_filename']} -> {ep['new_filename']}")
         else:
-            print(f"  Would move: {ep['original_filename']} -> {season_folder.name}/{ep['new_filename']}")
+            print(f"  Would move: {ep['original_filename']} -> {os.path.basename(season_folder)}/{ep['new_filename']}")
         
         moved_count += 1
         
         # Move related files with same name but different extensions (e.g., .nfo, .srt, .sub)
-        source_stem = source_file.stem  # filename without extension
-        source_parent = source_file.parent
-        dest_stem = dest_file.stem
+        dest_stem = os.path.splitext(ep['new_filename'])[0]
         
-        # Find all files with same name but different extension
-        for related_file in source_parent.glob(f"{source_stem}.*"):
-            if related_file == source_file:
+        for related_file in related_files:
+            if related_file.name == source_name:
                 continue  # Skip the main video file we already moved
             
-            # Get the extension and create destination path
-            extension = related_file.suffix
-            related_dest = season_folder / f"{dest_stem}{extension}"
+            # Get the extension and create destination name
+            extension = os.path.splitext(related_file.name)[1]
+            related_name = f"{dest_stem}{extension}"
             
             if not dry_run:
-                shutil.move(str(related_file), str(related_dest))
-                print(f"  ✓ Also moved: {related_file.name} -> {related_dest.name}")
+                shutil.move(related_file.path, os.path.join(season_folder, related_name))
+                print(f"  ✓ Also moved: {related_file.name} -> {related_name}")
             else:
-                print(f"    Would also move: {related_file.name} -> {related_dest.name}")
+                print(f"    Would also move: {related_file.name} -> {related_name}")
             
             moved_count += 1
     